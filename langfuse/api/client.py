@@ -20,6 +20,13 @@ from .resources.score.client import AsyncScoreClient, ScoreClient
 from .resources.sessions.client import AsyncSessionsClient, SessionsClient
 from .resources.trace.client import AsyncTraceClient, TraceClient
 
+try:
+    import h2  # type: ignore # noqa: F401
+
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
 
 class FernLangfuse:
     def __init__(
@@ -41,7 +48,7 @@ class FernLangfuse:
             x_langfuse_public_key=x_langfuse_public_key,
             username=username,
             password=password,
-            httpx_client=httpx.Client(timeout=timeout)
+            httpx_client=httpx.Client(timeout=timeout, http2=_HTTP2_AVAILABLE)
             if httpx_client is None
             else httpx_client,
         )
@@ -80,7 +87,7 @@ class AsyncFernLangfuse:
             x_langfuse_public_key=x_langfuse_public_key,
             username=username,
             password=password,
-            httpx_client=httpx.AsyncClient(timeout=timeout)
+            httpx_client=httpx.AsyncClient(timeout=timeout, http2=_HTTP2_AVAILABLE)
             if httpx_client is None
             else httpx_client,
         )
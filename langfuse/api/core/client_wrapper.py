@@ -22,8 +22,16 @@ class BaseClientWrapper:
         self._username = username
         self._password = password
         self._base_url = base_url
+        self._headers: typing.Optional[typing.Dict[str, str]] = None
 
     def get_headers(self) -> typing.Dict[str, str]:
+        """
+        Headers for every request. With static credentials the same dict is returned
+        on every call and shared by all resource clients, so it must not be mutated;
+        copy it to add request-specific headers.
+        """
+        if self._headers is not None:
+            return self._headers
         headers: typing.Dict[str, str] = {"X-Fern-Language": "Python"}
         username = self._get_username()
         password = self._get_password()
@@ -35,6 +43,9 @@ class BaseClientWrapper:
             headers["X-Langfuse-Sdk-Version"] = self._x_langfuse_sdk_version
         if self._x_langfuse_public_key is not None:
             headers["X-Langfuse-Public-Key"] = self._x_langfuse_public_key
+        # Headers only change between calls when credentials are resolved lazily
+        if not callable(self._username) and not callable(self._password):
+            self._headers = headers
         return headers
 
     def _get_username(self) -> typing.Optional[str]:
@@ -1,65 +1,326 @@
 # This file was auto-generated by Fern from our API Definition.
 
+import asyncio
+import collections
+import datetime as dt
+import email.utils
+import threading
+import time
 import typing
 import urllib.parse
 from json.decoder import JSONDecodeError
 
+import httpx
+
 from ...core.api_error import ApiError
 from ...core.client_wrapper import AsyncClientWrapper, SyncClientWrapper
-from ...core.remove_none_from_dict import remove_none_from_dict
 from ..commons.errors.access_denied_error import AccessDeniedError
 from ..commons.errors.error import Error
 from ..commons.errors.method_not_allowed_error import MethodNotAllowedError
 from ..commons.errors.not_found_error import NotFoundError
 from ..commons.errors.unauthorized_error import UnauthorizedError
+from ..commons.types.trace_with_details import TraceWithDetails
 from ..commons.types.trace_with_full_details import TraceWithFullDetails
+from ..utils.resources.pagination.types.meta_response import MetaResponse
 from .types.traces import Traces
 
 try:
-    import pydantic.v1 as pydantic  # type: ignore
+    from orjson import loads as _loads  # type: ignore
 except ImportError:
-    import pydantic  # type: ignore
+    from json import loads as _loads  # type: ignore
+
+# Bound once at import time. The models are validated directly instead of through
+# pydantic.parse_obj_as, which wraps every call in a throwaway root model.
+_parse_trace = TraceWithFullDetails.parse_obj
+_parse_traces = Traces.parse_obj
+_parse_trace_with_details = TraceWithDetails.parse_obj
+_parse_meta_response = MetaResponse.parse_obj
+_construct_trace = TraceWithFullDetails.construct
+_construct_traces = Traces.construct
+
+# Pages with at least this many traces are validated item by item
+_LARGE_PAGE_SIZE = 500
+
+_TRACES_PATH = "api/public/traces"
+
+_ERRORS_BY_STATUS_CODE: typing.Dict[int, typing.Type[ApiError]] = {
+    400: Error,
+    401: UnauthorizedError,
+    403: AccessDeniedError,
+    404: NotFoundError,
+    405: MethodNotAllowedError,
+}
+
+
+def _handle_error(_response: httpx.Response) -> typing.NoReturn:
+    """Raise the error matching a non-2xx trace API response."""
+    try:
+        _body = _loads(_response.content)
+    except JSONDecodeError:
+        # Decoding the raw bytes directly skips httpx's charset detection
+        raise ApiError(
+            status_code=_response.status_code,
+            body=_response.content.decode("utf-8", errors="replace"),
+        )
+    _error = _ERRORS_BY_STATUS_CODE.get(_response.status_code)
+    if _error is not None:
+        raise _error(_body)  # type: ignore
+    raise ApiError(status_code=_response.status_code, body=_body)
+
+
+def _extensions_kwargs(
+    extensions: typing.Optional[typing.Dict[str, typing.Any]]
+) -> typing.Dict[str, typing.Any]:
+    # Only forwarded when given, so httpx versions without request extensions keep working
+    return {} if extensions is None else {"extensions": extensions}
+
+
+_CachedTrace = typing.Tuple[str, TraceWithFullDetails]
+
+
+class _ETagCache:
+    """Bounded LRU of parsed traces and the ETag they were served with."""
+
+    __slots__ = ("_max_size", "_entries", "_lock")
+
+    def __init__(self, max_size: int = 1024):
+        self._max_size = max_size
+        self._entries: typing.OrderedDict[str, _CachedTrace] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, trace_id: str) -> typing.Optional[_CachedTrace]:
+        with self._lock:
+            entry = self._entries.get(trace_id)
+            if entry is not None:
+                self._entries.move_to_end(trace_id)
+            return entry
+
+    def set(self, trace_id: str, etag: str, trace: TraceWithFullDetails) -> None:
+        with self._lock:
+            self._entries[trace_id] = (etag, trace)
+            self._entries.move_to_end(trace_id)
+            if len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+
+def _conditional_headers(
+    headers: typing.Dict[str, str],
+    cached: typing.Optional[_CachedTrace],
+) -> typing.Dict[str, str]:
+    if cached is None:
+        return headers
+    return {**headers, "If-None-Match": cached[0]}
+
+
+def _parse_trace_and_cache(
+    _response: httpx.Response,
+    trace_id: str,
+    cached: typing.Optional[_CachedTrace],
+    etag_cache: _ETagCache,
+    validate: bool,
+) -> TraceWithFullDetails:
+    if _response.status_code == 304 and cached is not None:
+        return cached[1]
+    if 200 <= _response.status_code < 300:
+        _body = _loads(_response.content)
+        # Unvalidated models are never cached, so cache hits are always validated
+        if not validate:
+            return _construct_trace(**_body)
+        _trace = _parse_trace(_body)
+        _etag = _response.headers.get("etag")
+        if _etag is not None:
+            etag_cache.set(trace_id, _etag, _trace)
+        return _trace
+    _handle_error(_response)
+
+
+_ListCacheKey = typing.Tuple[typing.Tuple[str, typing.Union[str, int]], ...]
+
+
+class _ListCache:
+    """Bounded cache of trace list pages, kept for as long as the server allows."""
+
+    __slots__ = ("_max_size", "_entries", "_lock")
+
+    def __init__(self, max_size: int = 256):
+        self._max_size = max_size
+        self._entries: typing.OrderedDict[
+            _ListCacheKey, typing.Tuple[float, Traces]
+        ] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: _ListCacheKey) -> typing.Optional[Traces]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def set(self, key: _ListCacheKey, traces: Traces, ttl_seconds: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl_seconds, traces)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+
+def _list_params(
+    page: typing.Optional[int],
+    limit: typing.Optional[int],
+    user_id: typing.Optional[str],
+    name: typing.Optional[str],
+    order_by: str,
+    tags: typing.Optional[typing.Union[str, typing.List[str]]],
+) -> typing.List[typing.Tuple[str, typing.Union[str, int]]]:
+    """Builds the query as key/value pairs, one pair per tag, skipping unset values."""
+    params = [
+        (key, value)
+        for key, value in (
+            ("page", page),
+            ("limit", limit),
+            ("userId", user_id),
+            ("name", name),
+            ("orderBy", order_by),
+        )
+        if value is not None
+    ]
+    if isinstance(tags, list):
+        params.extend(("tags", tag) for tag in tags)
+    elif tags is not None:
+        params.append(("tags", tags))
+    return params
+
+
+def _cache_ttl_seconds(headers: httpx.Headers) -> typing.Optional[float]:
+    """Returns how long a response may be reused according to Cache-Control or Expires."""
+    cache_control = headers.get("cache-control")
+    if cache_control is not None:
+        directives = [
+            directive.strip().lower() for directive in cache_control.split(",")
+        ]
+        if "no-store" in directives or "no-cache" in directives:
+            return None
+        for directive in directives:
+            if directive.startswith("max-age="):
+                try:
+                    max_age = int(directive[len("max-age=") :])
+                except ValueError:
+                    return None
+                return max_age if max_age > 0 else None
+    expires = headers.get("expires")
+    if expires is not None:
+        try:
+            ttl_seconds = (
+                email.utils.parsedate_to_datetime(expires)
+                - dt.datetime.now(dt.timezone.utc)
+            ).total_seconds()
+        except (TypeError, ValueError):
+            return None
+        return ttl_seconds if ttl_seconds > 0 else None
+    return None
+
+
+def _parse_traces_body(body: typing.Any) -> Traces:
+    """
+    Validates a page of traces. On large pages every raw item is released as soon as
+    its model is built, so the decoded page and the models are not both held in full.
+    """
+    data = body.get("data") if isinstance(body, dict) else None
+    if not isinstance(data, list) or len(data) < _LARGE_PAGE_SIZE:
+        return _parse_traces(body)
+    data.reverse()
+    items = []
+    while data:
+        items.append(_parse_trace_with_details(data.pop()))
+    # The items are validated already, validating the page again would copy them
+    return _construct_traces(data=items, meta=_parse_meta_response(body.get("meta")))
+
+
+def _parse_traces_and_cache(
+    _response: httpx.Response,
+    key: _ListCacheKey,
+    list_cache: _ListCache,
+    validate: bool,
+) -> Traces:
+    if 200 <= _response.status_code < 300:
+        _body = _loads(_response.content)
+        if not validate:
+            return _construct_traces(**_body)
+        _traces = _parse_traces_body(_body)
+        _ttl_seconds = _cache_ttl_seconds(_response.headers)
+        if _ttl_seconds is not None:
+            list_cache.set(key, _traces, _ttl_seconds)
+        return _traces
+    _handle_error(_response)
 
 
 class TraceClient:
+    __slots__ = (
+        "_client_wrapper",
+        "_traces_url",
+        "_trace_prefix",
+        "_etag_cache",
+        "_list_cache",
+    )
+
     def __init__(self, *, client_wrapper: SyncClientWrapper):
         self._client_wrapper = client_wrapper
+        self._traces_url = httpx.URL(
+            urllib.parse.urljoin(
+                f"{self._client_wrapper.get_base_url()}/", _TRACES_PATH
+            )
+        )
+        self._trace_prefix = f"{self._traces_url}/"
+        self._etag_cache = _ETagCache()
+        self._list_cache = _ListCache()
+
+    def _do(
+        self,
+        url: typing.Union[str, httpx.URL],
+        *,
+        headers: typing.Dict[str, str],
+        params: typing.Optional[typing.List[typing.Tuple[str, typing.Any]]] = None,
+        extensions: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ) -> httpx.Response:
+        return self._client_wrapper.httpx_client.request(
+            "GET",
+            url,
+            params=params,
+            headers=headers,
+            timeout=60,
+            **_extensions_kwargs(extensions),
+        )
 
-    def get(self, trace_id: str) -> TraceWithFullDetails:
+    def get(
+        self,
+        trace_id: str,
+        *,
+        validate: bool = True,
+        extensions: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ) -> TraceWithFullDetails:
         """
-        Get a specific trace
+        Get a specific trace. Responses carrying an ETag are cached and revalidated
+        with If-None-Match, so an unchanged trace is answered by a 304 without a body.
 
         Parameters:
             - trace_id: str. The unique langfuse identifier of a trace
+
+            - validate: bool. Set to False to skip validation and trust the server's schema. The model is then built with construct(): nested objects and timestamps are left as decoded from JSON, and the result is not cached.
+
+            - extensions: typing.Optional[typing.Dict[str, typing.Any]]. Request extensions passed through to httpx, e.g. for a caching transport such as hishel's CacheTransport.
         """
-        _response = self._client_wrapper.httpx_client.request(
-            "GET",
-            urllib.parse.urljoin(
-                f"{self._client_wrapper.get_base_url()}/",
-                f"api/public/traces/{trace_id}",
-            ),
-            headers=self._client_wrapper.get_headers(),
-            timeout=60,
+        _cached = self._etag_cache.get(trace_id)
+        _response = self._do(
+            self._trace_prefix + trace_id,
+            headers=_conditional_headers(self._client_wrapper.get_headers(), _cached),
+            extensions=extensions,
+        )
+        return _parse_trace_and_cache(
+            _response, trace_id, _cached, self._etag_cache, validate
         )
-        if 200 <= _response.status_code < 300:
-            return pydantic.parse_obj_as(TraceWithFullDetails, _response.json())  # type: ignore
-        if _response.status_code == 400:
-            raise Error(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 401:
-            raise UnauthorizedError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 403:
-            raise AccessDeniedError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 405:
-            raise MethodNotAllowedError(
-                pydantic.parse_obj_as(typing.Any, _response.json())
-            )  # type: ignore
-        if _response.status_code == 404:
-            raise NotFoundError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        try:
-            _response_json = _response.json()
-        except JSONDecodeError:
-            raise ApiError(status_code=_response.status_code, body=_response.text)
-        raise ApiError(status_code=_response.status_code, body=_response_json)
 
     def list(
         self,
@@ -70,9 +331,12 @@ class TraceClient:
         name: typing.Optional[str] = None,
         order_by: str,
         tags: typing.Optional[typing.Union[str, typing.List[str]]] = None,
+        validate: bool = True,
+        extensions: typing.Optional[typing.Dict[str, typing.Any]] = None,
     ) -> Traces:
         """
-        Get list of traces
+        Get list of traces. Pages are cached for as long as the server's Cache-Control
+        or Expires headers allow; nothing is cached otherwise.
 
         Parameters:
             - page: typing.Optional[int].
@@ -86,85 +350,121 @@ class TraceClient:
             - order_by: str. Format of the string sort_by=timestamp.asc (id, timestamp, name, userId, release, version, public, bookmarked, sessionId)
 
             - tags: typing.Optional[typing.Union[str, typing.List[str]]]. Only traces that include all of these tags will be returned.
+
+            - validate: bool. Set to False to skip validation and trust the server's schema. The model is then built with construct(): nested objects and timestamps are left as decoded from JSON, and the result is not cached.
+
+            - extensions: typing.Optional[typing.Dict[str, typing.Any]]. Request extensions passed through to httpx, e.g. for a caching transport such as hishel's CacheTransport.
         """
-        _response = self._client_wrapper.httpx_client.request(
-            "GET",
-            urllib.parse.urljoin(
-                f"{self._client_wrapper.get_base_url()}/", "api/public/traces"
-            ),
-            params=remove_none_from_dict(
-                {
-                    "page": page,
-                    "limit": limit,
-                    "userId": user_id,
-                    "name": name,
-                    "orderBy": order_by,
-                    "tags": tags,
-                }
-            ),
+        _params = _list_params(page, limit, user_id, name, order_by, tags)
+        _key = tuple(_params)
+        _cached = self._list_cache.get(_key)
+        if _cached is not None:
+            return _cached
+        _response = self._do(
+            self._traces_url,
+            params=_params,
             headers=self._client_wrapper.get_headers(),
-            timeout=60,
+            extensions=extensions,
         )
-        if 200 <= _response.status_code < 300:
-            return pydantic.parse_obj_as(Traces, _response.json())  # type: ignore
-        if _response.status_code == 400:
-            raise Error(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 401:
-            raise UnauthorizedError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 403:
-            raise AccessDeniedError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 405:
-            raise MethodNotAllowedError(
-                pydantic.parse_obj_as(typing.Any, _response.json())
-            )  # type: ignore
-        if _response.status_code == 404:
-            raise NotFoundError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        try:
-            _response_json = _response.json()
-        except JSONDecodeError:
-            raise ApiError(status_code=_response.status_code, body=_response.text)
-        raise ApiError(status_code=_response.status_code, body=_response_json)
+        return _parse_traces_and_cache(_response, _key, self._list_cache, validate)
 
 
 class AsyncTraceClient:
+    __slots__ = (
+        "_client_wrapper",
+        "_traces_url",
+        "_trace_prefix",
+        "_etag_cache",
+        "_list_cache",
+    )
+
     def __init__(self, *, client_wrapper: AsyncClientWrapper):
         self._client_wrapper = client_wrapper
+        self._traces_url = httpx.URL(
+            urllib.parse.urljoin(
+                f"{self._client_wrapper.get_base_url()}/", _TRACES_PATH
+            )
+        )
+        self._trace_prefix = f"{self._traces_url}/"
+        self._etag_cache = _ETagCache()
+        self._list_cache = _ListCache()
 
-    async def get(self, trace_id: str) -> TraceWithFullDetails:
+    async def _do(
+        self,
+        url: typing.Union[str, httpx.URL],
+        *,
+        headers: typing.Dict[str, str],
+        params: typing.Optional[typing.List[typing.Tuple[str, typing.Any]]] = None,
+        extensions: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ) -> httpx.Response:
+        return await self._client_wrapper.httpx_client.request(
+            "GET",
+            url,
+            params=params,
+            headers=headers,
+            timeout=60,
+            **_extensions_kwargs(extensions),
+        )
+
+    async def get(
+        self,
+        trace_id: str,
+        *,
+        validate: bool = True,
+        extensions: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ) -> TraceWithFullDetails:
         """
-        Get a specific trace
+        Get a specific trace. Responses carrying an ETag are cached and revalidated
+        with If-None-Match, so an unchanged trace is answered by a 304 without a body.
 
         Parameters:
             - trace_id: str. The unique langfuse identifier of a trace
+
+            - validate: bool. Set to False to skip validation and trust the server's schema. The model is then built with construct(): nested objects and timestamps are left as decoded from JSON, and the result is not cached.
+
+            - extensions: typing.Optional[typing.Dict[str, typing.Any]]. Request extensions passed through to httpx, e.g. for a caching transport such as hishel's CacheTransport.
         """
-        _response = await self._client_wrapper.httpx_client.request(
-            "GET",
-            urllib.parse.urljoin(
-                f"{self._client_wrapper.get_base_url()}/",
-                f"api/public/traces/{trace_id}",
-            ),
-            headers=self._client_wrapper.get_headers(),
-            timeout=60,
+        _cached = self._etag_cache.get(trace_id)
+        _response = await self._do(
+            self._trace_prefix + trace_id,
+            headers=_conditional_headers(self._client_wrapper.get_headers(), _cached),
+            extensions=extensions,
         )
-        if 200 <= _response.status_code < 300:
-            return pydantic.parse_obj_as(TraceWithFullDetails, _response.json())  # type: ignore
-        if _response.status_code == 400:
-            raise Error(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 401:
-            raise UnauthorizedError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 403:
-            raise AccessDeniedError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 405:
-            raise MethodNotAllowedError(
-                pydantic.parse_obj_as(typing.Any, _response.json())
-            )  # type: ignore
-        if _response.status_code == 404:
-            raise NotFoundError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        try:
-            _response_json = _response.json()
-        except JSONDecodeError:
-            raise ApiError(status_code=_response.status_code, body=_response.text)
-        raise ApiError(status_code=_response.status_code, body=_response_json)
+        return _parse_trace_and_cache(
+            _response, trace_id, _cached, self._etag_cache, validate
+        )
+
+    async def get_many(
+        self,
+        trace_ids: typing.List[str],
+        *,
+        concurrency: int = 16,
+        validate: bool = True,
+        extensions: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ) -> typing.List[TraceWithFullDetails]:
+        """
+        Get several traces concurrently, in the order of the given ids
+
+        Parameters:
+            - trace_ids: typing.List[str]. The unique langfuse identifiers of the traces
+
+            - concurrency: int. Maximum number of requests in flight at once, at least 1
+
+            - validate: bool. Passed to get() for every trace.
+
+            - extensions: typing.Optional[typing.Dict[str, typing.Any]]. Passed to get() for every trace.
+        """
+        if concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1, got {concurrency}")
+        _semaphore = asyncio.Semaphore(concurrency)
+
+        async def _get(trace_id: str) -> TraceWithFullDetails:
+            async with _semaphore:
+                return await self.get(
+                    trace_id, validate=validate, extensions=extensions
+                )
+
+        return list(await asyncio.gather(*(_get(trace_id) for trace_id in trace_ids)))
 
     async def list(
         self,
@@ -175,9 +475,12 @@ class AsyncTraceClient:
         name: typing.Optional[str] = None,
         order_by: str,
         tags: typing.Optional[typing.Union[str, typing.List[str]]] = None,
+        validate: bool = True,
+        extensions: typing.Optional[typing.Dict[str, typing.Any]] = None,
     ) -> Traces:
         """
-        Get list of traces
+        Get list of traces. Pages are cached for as long as the server's Cache-Control
+        or Expires headers allow; nothing is cached otherwise.
 
         Parameters:
             - page: typing.Optional[int].
@@ -191,41 +494,20 @@ class AsyncTraceClient:
             - order_by: str. Format of the string sort_by=timestamp.asc (id, timestamp, name, userId, release, version, public, bookmarked, sessionId)
 
             - tags: typing.Optional[typing.Union[str, typing.List[str]]]. Only traces that include all of these tags will be returned.
+
+            - validate: bool. Set to False to skip validation and trust the server's schema. The model is then built with construct(): nested objects and timestamps are left as decoded from JSON, and the result is not cached.
+
+            - extensions: typing.Optional[typing.Dict[str, typing.Any]]. Request extensions passed through to httpx, e.g. for a caching transport such as hishel's CacheTransport.
         """
-        _response = await self._client_wrapper.httpx_client.request(
-            "GET",
-            urllib.parse.urljoin(
-                f"{self._client_wrapper.get_base_url()}/", "api/public/traces"
-            ),
-            params=remove_none_from_dict(
-                {
-                    "page": page,
-                    "limit": limit,
-                    "userId": user_id,
-                    "name": name,
-                    "orderBy": order_by,
-                    "tags": tags,
-                }
-            ),
+        _params = _list_params(page, limit, user_id, name, order_by, tags)
+        _key = tuple(_params)
+        _cached = self._list_cache.get(_key)
+        if _cached is not None:
+            return _cached
+        _response = await self._do(
+            self._traces_url,
+            params=_params,
             headers=self._client_wrapper.get_headers(),
-            timeout=60,
+            extensions=extensions,
         )
-        if 200 <= _response.status_code < 300:
-            return pydantic.parse_obj_as(Traces, _response.json())  # type: ignore
-        if _response.status_code == 400:
-            raise Error(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 401:
-            raise UnauthorizedError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 403:
-            raise AccessDeniedError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        if _response.status_code == 405:
-            raise MethodNotAllowedError(
-                pydantic.parse_obj_as(typing.Any, _response.json())
-            )  # type: ignore
-        if _response.status_code == 404:
-            raise NotFoundError(pydantic.parse_obj_as(typing.Any, _response.json()))  # type: ignore
-        try:
-            _response_json = _response.json()
-        except JSONDecodeError:
-            raise ApiError(status_code=_response.status_code, body=_response.text)
-        raise ApiError(status_code=_response.status_code, body=_response_json)
+        return _parse_traces_and_cache(_response, _key, self._list_cache, validate)
@@ -1,12 +1,13 @@
+from __future__ import annotations
+
 import logging
 import os
-from typing import Any, Dict, List, Optional, Sequence, Union
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Union
 from uuid import UUID, uuid4
 
 from langchain.callbacks.base import BaseCallbackHandler
 
 from langfuse.api.resources.commons.types.observation_level import ObservationLevel
-from langfuse.api.resources.ingestion.types.sdk_log_body import SdkLogBody
 from langfuse.client import (
     Langfuse,
     StatefulSpanClient,
@@ -17,20 +18,22 @@ from langfuse.extract_model import _extract_model_name
 from langfuse.task_manager import TaskManager
 from langfuse.utils import _get_timestamp
 
-try:
+if TYPE_CHECKING:
     from langchain.schema.agent import AgentAction, AgentFinish
     from langchain.schema.document import Document
     from langchain.schema.messages import BaseMessage
     from langchain.schema.output import LLMResult
-except ImportError:
-    logging.getLogger("langfuse").warning(
-        "Could not import langchain. Some functionality may be missing."
-    )
-    LLMResult = Any
-    BaseMessage = Any
-    Document = Any
-    AgentAction = Any
-    AgentFinish = Any
+
+_UNKNOWN_RUN_NAME = "<unknown>"
+
+_LLM_PARAM_KEYS = (
+    "temperature",
+    "max_tokens",
+    "top_p",
+    "frequency_penalty",
+    "presence_penalty",
+    "request_timeout",
+)
 
 
 class CallbackHandler(BaseCallbackHandler):
@@ -128,6 +131,7 @@ class CallbackHandler(BaseCallbackHandler):
             self.langfuse = Langfuse(**args)
             self.trace = None
             self.root_span = None
+            # Runs are keyed by UUID.int, which hashes in C unlike UUID.__hash__
             self.runs = {}
             self.session_id = session_id
             self.user_id = user_id
@@ -179,9 +183,14 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         """Run on new LLM token. Only available when streaming is enabled."""
         # Nothing needs to happen here for langfuse. Once the streaming is done,
-        self.log.debug(
-            f"on llm new token: run_id: {run_id} parent_run_id: {parent_run_id}"
-        )
+        # the full response is recorded in on_llm_end. This runs once per token,
+        # so skip even the debug call unless debug logging is on.
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(
+                "on llm new token: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
+            )
 
     def get_langchain_run_name(self, serialized: Dict[str, Any], **kwargs: Any) -> str:
         """
@@ -198,11 +207,22 @@ class CallbackHandler(BaseCallbackHandler):
         """
 
         # Check if 'name' is in kwargs and not None, otherwise use default fallback logic
-        if "name" in kwargs and kwargs["name"] is not None:
-            return kwargs["name"]
+        name = kwargs.get("name")
+        if name is not None:
+            return name
 
         # Fallback to serialized 'name', 'id', or "<unknown>"
-        return serialized.get("name", serialized.get("id", ["<unknown>"]))[-1]
+        name = serialized.get("name")
+        if name is not None:
+            return name if isinstance(name, str) else name[-1]
+
+        serialized_id = serialized.get("id")
+        if serialized_id is not None:
+            return (
+                serialized_id[-1] if isinstance(serialized_id, list) else serialized_id
+            )
+
+        return _UNKNOWN_RUN_NAME
 
     def on_retriever_error(
         self,
@@ -215,13 +235,17 @@ class CallbackHandler(BaseCallbackHandler):
         """Run when Retriever errors."""
         try:
             self.log.debug(
-                f"on retriever error: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on retriever error: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
 
-            if run_id is None or run_id not in self.runs:
-                raise Exception("run not found")
+            runs = self.runs
+            if run_id is None or run_id.int not in runs:
+                self.log.warning("run not found: %s", run_id)
+                return
 
-            self.runs[run_id] = self.runs[run_id].end(
+            runs[run_id.int] = runs[run_id.int].end(
                 level=ObservationLevel.ERROR,
                 status_message=str(error),
                 version=self.version,
@@ -241,40 +265,49 @@ class CallbackHandler(BaseCallbackHandler):
         **kwargs: Any,
     ) -> Any:
         try:
+            class_name = self.get_langchain_run_name(serialized, **kwargs)
             self.log.debug(
-                f"on chain start: run_id: {run_id} parent_run_id: {parent_run_id}, name {serialized.get('name', serialized.get('id', ['<unknown>'])[-1])}"
+                "on chain start: run_id: %s parent_run_id: %s, name %s",
+                run_id,
+                parent_run_id,
+                class_name,
             )
+            merged_metadata = self.__join_tags_and_metadata(tags, metadata)
             self.__generate_trace_and_parent(
-                serialized=serialized,
                 inputs=inputs,
                 run_id=run_id,
                 parent_run_id=parent_run_id,
-                tags=tags,
-                metadata=metadata,
-                version=self.version,
-                **kwargs,
+                class_name=class_name,
+                merged_metadata=merged_metadata,
             )
 
-            content = {
-                "id": self.next_span_id,
-                "trace_id": self.trace.id,
-                "name": self.get_langchain_run_name(serialized, **kwargs),
-                "metadata": self.__join_tags_and_metadata(tags, metadata),
-                "input": inputs,
-                "version": self.version,
-            }
+            parent = self.__get_parent(parent_run_id)
 
-            if parent_run_id is None:
-                if self.root_span is None:
-                    self.runs[run_id] = self.trace.span(**content)
-                else:
-                    self.runs[run_id] = self.root_span.span(**content)
-            if parent_run_id is not None:
-                self.runs[run_id] = self.runs[parent_run_id].span(**content)
+            self.runs[run_id.int] = parent.span(
+                id=self.next_span_id,
+                trace_id=self.trace.id,
+                name=class_name,
+                metadata=merged_metadata,
+                input=inputs,
+                version=self.version,
+            )
 
         except Exception as e:
             self.log.exception(e)
 
+    def __get_parent(self, parent_run_id: Optional[UUID]):
+        """
+        Returns the client a new run is attached to: its parent run if known,
+        otherwise the root span, or the trace if there is no root span. The
+        same rule applies whether the parent run id is missing or unknown.
+        """
+        if parent_run_id is not None:
+            parent = self.runs.get(parent_run_id.int)
+            if parent is not None:
+                return parent
+
+        return self.trace if self.root_span is None else self.root_span
+
     def get_trace_id(self) -> str:
         return self.trace.id
 
@@ -283,18 +316,14 @@ class CallbackHandler(BaseCallbackHandler):
 
     def __generate_trace_and_parent(
         self,
-        serialized: Dict[str, Any],
         inputs: Dict[str, Any],
         *,
         run_id: UUID,
         parent_run_id: Optional[UUID] = None,
-        tags: Optional[List[str]] = None,
-        metadata: Optional[Dict[str, Any]] = None,
-        **kwargs: Any,
+        class_name: str,
+        merged_metadata: Optional[Dict[str, Any]] = None,
     ):
         try:
-            class_name = self.get_langchain_run_name(serialized, **kwargs)
-
             # on a new invocation, and not user provided root, we want to initialise a new trace
             # parent_run_id is None when we are at the root of a langchain execution
             if (
@@ -311,7 +340,7 @@ class CallbackHandler(BaseCallbackHandler):
                 trace = self.langfuse.trace(
                     id=str(run_id),
                     name=self.trace_name if self.trace_name is not None else class_name,
-                    metadata=self.__join_tags_and_metadata(tags, metadata),
+                    metadata=merged_metadata,
                     version=self.version,
                     session_id=self.session_id,
                     user_id=self.user_id,
@@ -320,12 +349,12 @@ class CallbackHandler(BaseCallbackHandler):
 
                 self.trace = trace
 
-                if parent_run_id is not None and parent_run_id in self.runs:
-                    self.runs[run_id] = self.trace.span(
+                if parent_run_id is not None and parent_run_id.int in self.runs:
+                    self.runs[run_id.int] = self.trace.span(
                         id=self.next_span_id,
                         trace_id=self.trace.id,
                         name=class_name,
-                        metadata=self.__join_tags_and_metadata(tags, metadata),
+                        metadata=merged_metadata,
                         input=inputs,
                         version=self.version,
                     )
@@ -346,15 +375,17 @@ class CallbackHandler(BaseCallbackHandler):
         """Run on agent action."""
         try:
             self.log.debug(
-                f"on agent action: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on agent action: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
 
-            if run_id not in self.runs:
-                raise Exception("run not found")
+            runs = self.runs
+            if run_id.int not in runs:
+                self.log.warning("run not found: %s", run_id)
+                return
 
-            self.runs[run_id] = self.runs[run_id].end(
-                output=action, version=self.version
-            )
+            runs[run_id.int] = runs[run_id.int].end(output=action, version=self.version)
 
         except Exception as e:
             self.log.exception(e)
@@ -369,14 +400,16 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         try:
             self.log.debug(
-                f"on agent finish: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on agent finish: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
-            if run_id not in self.runs:
-                raise Exception("run not found")
+            runs = self.runs
+            if run_id.int not in runs:
+                self.log.warning("run not found: %s", run_id)
+                return
 
-            self.runs[run_id] = self.runs[run_id].end(
-                output=finish, version=self.version
-            )
+            runs[run_id.int] = runs[run_id.int].end(output=finish, version=self.version)
 
             self._update_trace(run_id, parent_run_id, finish)
 
@@ -393,13 +426,17 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         try:
             self.log.debug(
-                f"on chain end: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on chain end: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
 
-            if run_id not in self.runs:
-                raise Exception("run not found")
+            runs = self.runs
+            if run_id.int not in runs:
+                self.log.warning("run not found: %s", run_id)
+                return
 
-            self.runs[run_id] = self.runs[run_id].end(
+            runs[run_id.int] = runs[run_id.int].end(
                 output=outputs, version=self.version
             )
 
@@ -418,9 +455,16 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> None:
         try:
             self.log.debug(
-                f"on chain error: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on chain error: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
-            self.runs[run_id] = self.runs[run_id].end(
+            runs = self.runs
+            if run_id.int not in runs:
+                self.log.warning("run not found: %s", run_id)
+                return
+
+            runs[run_id.int] = runs[run_id.int].end(
                 level=ObservationLevel.ERROR,
                 status_message=str(error),
                 version=self.version,
@@ -444,7 +488,9 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         try:
             self.log.debug(
-                f"on chat model start: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on chat model start: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
             self.__on_llm_action(
                 serialized,
@@ -471,7 +517,9 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         try:
             self.log.debug(
-                f"on llm start: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on llm start: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
             self.__on_llm_action(
                 serialized,
@@ -498,18 +546,23 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         try:
             self.log.debug(
-                f"on tool start: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on tool start: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
 
-            if parent_run_id is None or parent_run_id not in self.runs:
-                raise Exception("parent run not found")
-            meta = self.__join_tags_and_metadata(tags, metadata)
-
+            # Tools and retrievers cannot start a trace of their own
+            parent = None if parent_run_id is None else self.__get_parent(parent_run_id)
+            if parent is None:
+                self.log.warning("parent run not found: %s", parent_run_id)
+                return
+            # Copied, as the joined metadata may be the caller's own dict
+            meta = dict(self.__join_tags_and_metadata(tags, metadata) or {})
             meta.update(
                 {key: value for key, value in kwargs.items() if value is not None}
             )
 
-            self.runs[run_id] = self.runs[parent_run_id].span(
+            self.runs[run_id.int] = parent.span(
                 id=self.next_span_id,
                 name=self.get_langchain_run_name(serialized, **kwargs),
                 input=input_str,
@@ -533,13 +586,17 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         try:
             self.log.debug(
-                f"on retriever start: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on retriever start: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
 
-            if parent_run_id is None or parent_run_id not in self.runs:
-                raise Exception("parent run not found")
+            parent = None if parent_run_id is None else self.__get_parent(parent_run_id)
+            if parent is None:
+                self.log.warning("parent run not found: %s", parent_run_id)
+                return
 
-            self.runs[run_id] = self.runs[parent_run_id].span(
+            self.runs[run_id.int] = parent.span(
                 id=self.next_span_id,
                 name=self.get_langchain_run_name(serialized, **kwargs),
                 input=query,
@@ -560,13 +617,17 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         try:
             self.log.debug(
-                f"on retriever end: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on retriever end: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
 
-            if run_id is None or run_id not in self.runs:
-                raise Exception("run not found")
+            runs = self.runs
+            if run_id is None or run_id.int not in runs:
+                self.log.warning("run not found: %s", run_id)
+                return
 
-            self.runs[run_id] = self.runs[run_id].end(
+            runs[run_id.int] = runs[run_id.int].end(
                 output=documents, version=self.version
             )
 
@@ -585,14 +646,16 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         try:
             self.log.debug(
-                f"on tool end: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on tool end: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
-            if run_id is None or run_id not in self.runs:
-                raise Exception("run not found")
+            runs = self.runs
+            if run_id is None or run_id.int not in runs:
+                self.log.warning("run not found: %s", run_id)
+                return
 
-            self.runs[run_id] = self.runs[run_id].end(
-                output=output, version=self.version
-            )
+            runs[run_id.int] = runs[run_id.int].end(output=output, version=self.version)
 
             self._update_trace(run_id, parent_run_id, output)
 
@@ -609,12 +672,16 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         try:
             self.log.debug(
-                f"on tool error: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on tool error: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
-            if run_id is None or run_id not in self.runs:
-                raise Exception("run not found")
+            runs = self.runs
+            if run_id is None or run_id.int not in runs:
+                self.log.warning("run not found: %s", run_id)
+                return
 
-            self.runs[run_id] = self.runs[run_id].end(
+            runs[run_id.int] = runs[run_id.int].end(
                 status_message=error, level=ObservationLevel.ERROR, version=self.version
             )
 
@@ -634,53 +701,37 @@ class CallbackHandler(BaseCallbackHandler):
         **kwargs: Any,
     ):
         try:
+            class_name = self.get_langchain_run_name(serialized, **kwargs)
+            merged_metadata = self.__join_tags_and_metadata(tags, metadata)
             self.__generate_trace_and_parent(
-                serialized,
                 inputs=prompts,
                 run_id=run_id,
                 parent_run_id=parent_run_id,
-                tags=tags,
-                metadata=metadata,
-                version=self.version,
-                kwargs=kwargs,
+                class_name=class_name,
+                merged_metadata=merged_metadata,
             )
 
             model_name = None
 
             model_name = self._parse_model_and_log_errors(serialized, kwargs)
 
-            content = {
-                "name": self.get_langchain_run_name(serialized, **kwargs),
-                "input": prompts,
-                "metadata": self.__join_tags_and_metadata(tags, metadata),
-                "model": model_name,
-                "model_parameters": {
-                    key: value
-                    for key, value in {
-                        "temperature": kwargs["invocation_params"].get("temperature"),
-                        "max_tokens": kwargs["invocation_params"].get("max_tokens"),
-                        "top_p": kwargs["invocation_params"].get("top_p"),
-                        "frequency_penalty": kwargs["invocation_params"].get(
-                            "frequency_penalty"
-                        ),
-                        "presence_penalty": kwargs["invocation_params"].get(
-                            "presence_penalty"
-                        ),
-                        "request_timeout": kwargs["invocation_params"].get(
-                            "request_timeout"
-                        ),
-                    }.items()
-                    if value is not None
-                },
-                "version": self.version,
-            }
-
-            if parent_run_id in self.runs:
-                self.runs[run_id] = self.runs[parent_run_id].generation(**content)
-            elif self.root_span is not None and parent_run_id is None:
-                self.runs[run_id] = self.root_span.generation(**content)
-            else:
-                self.runs[run_id] = self.trace.generation(**content)
+            invocation_params = kwargs.get("invocation_params") or {}
+            model_parameters = {}
+            for key in _LLM_PARAM_KEYS:
+                value = invocation_params.get(key)
+                if value is not None:
+                    model_parameters[key] = value
+
+            parent = self.__get_parent(parent_run_id)
+
+            self.runs[run_id.int] = parent.generation(
+                name=class_name,
+                input=prompts,
+                metadata=merged_metadata,
+                model=model_name,
+                model_parameters=model_parameters,
+                version=self.version,
+            )
 
         except Exception as e:
             self.log.exception(e)
@@ -692,33 +743,25 @@ class CallbackHandler(BaseCallbackHandler):
             model_name = _extract_model_name(serialized, **kwargs)
             if model_name:
                 return model_name
-
-            if model_name is None:
-                self.log.warning(
-                    "Langfuse was not able to parse the LLM model. The LLM call will be recorded without model name. Please create an issue so we can fix your integration: https://github.com/langfuse/langfuse/issues/new/choose"
-                )
-                self._report_error(
-                    {
-                        "log": "unable to parse model name",
-                        "kwargs": str(kwargs),
-                        "serialized": str(serialized),
-                    }
-                )
+            exception = None
         except Exception as e:
             self.log.exception(e)
-            self.log.warning(
-                "Langfuse was not able to parse the LLM model. The LLM call will be recorded without model name. Please create an issue so we can fix your integration: https://github.com/langfuse/langfuse/issues/new/choose"
-            )
-            self._report_error(
-                {
-                    "log": "unable to parse model name",
-                    "kwargs": str(kwargs),
-                    "serialized": str(serialized),
-                    "exception": str(e),
-                }
-            )
+            exception = e
 
-            return None
+        self.log.warning(
+            "Langfuse was not able to parse the LLM model. The LLM call will be recorded without model name. Please create an issue so we can fix your integration: https://github.com/langfuse/langfuse/issues/new/choose"
+        )
+        # Only stringified here, as kwargs and serialized can hold entire prompts
+        error = {
+            "log": "unable to parse model name",
+            "kwargs": str(kwargs),
+            "serialized": str(serialized),
+        }
+        if exception is not None:
+            error["exception"] = str(exception)
+        self._report_error(error)
+
+        return None
 
     def on_llm_end(
         self,
@@ -730,25 +773,33 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         try:
             self.log.debug(
-                f"on llm end: run_id: {run_id} parent_run_id: {parent_run_id} response: {response} kwargs: {kwargs}"
-            )
-            if run_id not in self.runs:
-                raise Exception("Run not found, see docs what to do in this case.")
-            else:
-                last_response = response.generations[-1][-1]
-                llm_usage = (
-                    None
-                    if response.llm_output is None
-                    else response.llm_output["token_usage"]
+                "on llm end: run_id: %s parent_run_id: %s response: %s kwargs: %s",
+                run_id,
+                parent_run_id,
+                response,
+                kwargs,
+            )
+            runs = self.runs
+            if run_id.int not in runs:
+                self.log.warning(
+                    "Run not found, see docs what to do in this case: %s", run_id
                 )
+                return
 
-                extracted_response = _extract_response(last_response)
+            last_response = response.generations[-1][-1]
+            llm_usage = (
+                None
+                if response.llm_output is None
+                else response.llm_output["token_usage"]
+            )
 
-                self.runs[run_id] = self.runs[run_id].end(
-                    output=extracted_response, usage=llm_usage, version=self.version
-                )
+            extracted_response = _extract_response(last_response)
 
-                self._update_trace(run_id, parent_run_id, extracted_response)
+            runs[run_id.int] = runs[run_id.int].end(
+                output=extracted_response, usage=llm_usage, version=self.version
+            )
+
+            self._update_trace(run_id, parent_run_id, extracted_response)
 
         except Exception as e:
             self.log.exception(e)
@@ -763,9 +814,16 @@ class CallbackHandler(BaseCallbackHandler):
     ) -> Any:
         try:
             self.log.debug(
-                f"on llm error: run_id: {run_id} parent_run_id: {parent_run_id}"
+                "on llm error: run_id: %s parent_run_id: %s",
+                run_id,
+                parent_run_id,
             )
-            self.runs[run_id] = self.runs[run_id].end(
+            runs = self.runs
+            if run_id.int not in runs:
+                self.log.warning("run not found: %s", run_id)
+                return
+
+            runs[run_id.int] = runs[run_id.int].end(
                 status_message=str(error),
                 level=ObservationLevel.ERROR,
                 version=self.version,
@@ -780,29 +838,27 @@ class CallbackHandler(BaseCallbackHandler):
         tags: Optional[List[str]] = None,
         metadata: Optional[Dict[str, Any]] = None,
     ) -> Optional[Dict[str, Any]]:
-        if tags is None and metadata is None:
-            return None
-        elif tags is not None and len(tags) > 0:
-            final_dict = {"tags": tags}
-            if metadata is not None:
-                final_dict.update(metadata)  # Merge metadata into final_dict
-            return final_dict
-        else:
+        # May return the caller's metadata dict itself, so callers must not mutate it
+        if not tags:
             return metadata
+        if not metadata:
+            return {"tags": tags}
+        final_dict = {"tags": tags}
+        final_dict.update(metadata)  # Merge metadata into final_dict
+        return final_dict
 
     def _report_error(self, error: dict):
-        event = SdkLogBody(log=error)
-
+        # Equivalent to SdkLogBody(log=error).dict(), as its only field is untyped
         self._task_manager.add_task(
             {
                 "id": str(uuid4()),
                 "type": "sdk-log",
                 "timestamp": _get_timestamp(),
-                "body": event.dict(),
+                "body": {"log": error},
             }
         )
 
-    def _update_trace(self, run_id: str, parent_run_id: Optional[str], output: any):
+    def _update_trace(self, run_id: UUID, parent_run_id: Optional[UUID], output: Any):
         """Update the trace with the output of the current run. Called at every finish callback event."""
 
         if (
@@ -820,8 +876,10 @@ def _extract_response(last_response):
 
     # We return the text of the response if not empty, otherwise the additional_kwargs
     # Additional kwargs contains the response in case of tool usage
-    return (
-        last_response.text.strip()
-        if last_response.text is not None and last_response.text.strip() != ""
-        else last_response.message.additional_kwargs
-    )
+    text = last_response.text
+    if text:
+        stripped = text.strip()
+        if stripped:
+            return stripped
+
+    return last_response.message.additional_kwargs
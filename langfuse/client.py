@@ -44,7 +44,12 @@ from langfuse.logging import clean_logger
 from langfuse.model import Dataset, MapValue, Observation, TraceWithFullDetails
 from langfuse.request import LangfuseClient
 from langfuse.task_manager import TaskManager
-from langfuse.utils import _convert_usage_input, _create_prompt_context, _get_timestamp
+from langfuse.utils import (
+    _HTTP2_AVAILABLE,
+    _convert_usage_input,
+    _create_prompt_context,
+    _get_timestamp,
+)
 
 from .version import __version__ as version
 
@@ -101,8 +106,12 @@ class Langfuse(object):
                 "secret_key is required, set as parameter or environment variable 'LANGFUSE_SECRET_KEY'"
             )
 
+        # A single pooled client is shared by the API and ingestion clients so
+        # connections are kept alive across requests; HTTP/2 is used when h2 is installed.
         self.httpx_client = (
-            httpx.Client(timeout=timeout) if httpx_client is None else httpx_client
+            httpx.Client(timeout=timeout, http2=_HTTP2_AVAILABLE)
+            if httpx_client is None
+            else httpx_client
         )
 
         self.client = FernLangfuse(
@@ -11,6 +11,13 @@ from langfuse.model import ModelUsage, PromptClient
 
 log = logging.getLogger("langfuse")
 
+try:
+    import h2  # type: ignore # noqa: F401
+
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
 
 def _get_timestamp():
     return datetime.now(timezone.utc)
@@ -0,0 +1,45 @@
+import httpx
+
+from langfuse.api.core.client_wrapper import SyncClientWrapper
+
+
+def create_client_wrapper(username, password):
+    return SyncClientWrapper(
+        username=username,
+        password=password,
+        base_url="http://localhost:3000",
+        httpx_client=httpx.Client(),
+    )
+
+
+def test_static_credentials_headers_are_reused():
+    client_wrapper = create_client_wrapper("public_key", "secret_key")
+
+    first = client_wrapper.get_headers()
+
+    assert client_wrapper.get_headers() is first
+    assert (
+        first["Authorization"]
+        == httpx.BasicAuth("public_key", "secret_key")._auth_header
+    )
+
+
+def test_callable_credentials_are_resolved_on_every_call():
+    calls = []
+
+    def password():
+        calls.append(True)
+        return f"secret_key_{len(calls)}"
+
+    client_wrapper = create_client_wrapper(lambda: "public_key", password)
+
+    first = client_wrapper.get_headers()
+    second = client_wrapper.get_headers()
+
+    assert len(calls) == 2
+    assert first["Authorization"] == (
+        httpx.BasicAuth("public_key", "secret_key_1")._auth_header
+    )
+    assert second["Authorization"] == (
+        httpx.BasicAuth("public_key", "secret_key_2")._auth_header
+    )
@@ -1,5 +1,6 @@
 import os
 from typing import Any, List, Mapping, Optional
+from uuid import uuid4
 
 import pytest
 from langchain_community.llms.anthropic import Anthropic
@@ -25,8 +26,13 @@ from langchain.text_splitter import CharacterTextSplitter
 from langchain.vectorstores import Chroma
 from pydantic import BaseModel, Field
 from langchain.schema import HumanMessage, SystemMessage
-from langfuse.callback import CallbackHandler
-from langfuse.client import Langfuse
+from langfuse.callback import _UNKNOWN_RUN_NAME, CallbackHandler
+from langfuse.client import (
+    Langfuse,
+    StatefulSpanClient,
+    StatefulTraceClient,
+    StateType,
+)
 from tests.api_wrapper import LangfuseAPI
 from tests.utils import create_uuid, get_api
 from langchain_core.callbacks.manager import CallbackManagerForLLMRun
@@ -1375,3 +1381,120 @@ def test_names_on_spans_lcel():
         )
         == 1
     )
+
+
+class RecordingTaskManager:
+    def __init__(self):
+        self.events = []
+
+    def add_task(self, event: dict):
+        self.events.append(event)
+
+
+def create_offline_handler():
+    task_manager = RecordingTaskManager()
+    trace = StatefulTraceClient(
+        None, "trace-id", StateType.TRACE, "trace-id", task_manager
+    )
+    return CallbackHandler(stateful_client=trace), task_manager
+
+
+@pytest.mark.parametrize(
+    "serialized, kwargs, expected",
+    [
+        ({"name": "serialized-name"}, {"name": "kwargs-name"}, "kwargs-name"),
+        ({"name": "search"}, {}, "search"),
+        ({"name": ["langchain", "tools", "Search"]}, {}, "Search"),
+        ({"id": ["langchain", "chains", "LLMChain"]}, {"name": None}, "LLMChain"),
+        ({}, {}, _UNKNOWN_RUN_NAME),
+    ],
+)
+def test_get_langchain_run_name(serialized, kwargs, expected):
+    handler, _ = create_offline_handler()
+
+    assert handler.get_langchain_run_name(serialized, **kwargs) == expected
+
+
+def start_chain(handler: CallbackHandler):
+    chain_run_id = uuid4()
+    handler.on_chain_start(
+        {"id": ["langchain", "chains", "LLMChain"]},
+        {"question": "hi"},
+        run_id=chain_run_id,
+    )
+    return chain_run_id
+
+
+def test_tool_start_without_tags_or_metadata():
+    handler, task_manager = create_offline_handler()
+    chain_run_id = start_chain(handler)
+    tool_run_id = uuid4()
+
+    handler.on_tool_start(
+        {"name": "search"},
+        "query",
+        run_id=tool_run_id,
+        parent_run_id=chain_run_id,
+        tags=None,
+        metadata=None,
+    )
+
+    assert tool_run_id.int in handler.runs
+    tool_span = task_manager.events[-1]
+    assert tool_span["type"] == "span-create"
+    assert tool_span["body"]["name"] == "search"
+
+
+def test_tool_start_does_not_mutate_caller_metadata():
+    handler, task_manager = create_offline_handler()
+    chain_run_id = start_chain(handler)
+    metadata = {"key": "value"}
+
+    handler.on_tool_start(
+        {"name": "search"},
+        "query",
+        run_id=uuid4(),
+        parent_run_id=chain_run_id,
+        metadata=metadata,
+        foo="bar",
+    )
+
+    assert metadata == {"key": "value"}
+    assert task_manager.events[-1]["body"]["metadata"] == {
+        "key": "value",
+        "foo": "bar",
+    }
+
+
+@pytest.mark.parametrize("root_span", [False, True])
+@pytest.mark.parametrize("callback", ["chain", "llm", "tool", "retriever"])
+def test_run_with_unknown_parent_attaches_to_root(callback, root_span):
+    if root_span:
+        task_manager = RecordingTaskManager()
+        span = StatefulSpanClient(
+            None, "span-id", StateType.OBSERVATION, "trace-id", task_manager
+        )
+        handler = CallbackHandler(stateful_client=span)
+    else:
+        handler, task_manager = create_offline_handler()
+    run_id = uuid4()
+    kwargs = {"run_id": run_id, "parent_run_id": uuid4()}
+
+    if callback == "chain":
+        handler.on_chain_start({"id": ["LLMChain"]}, {"question": "hi"}, **kwargs)
+    elif callback == "llm":
+        handler.on_llm_start(
+            {"id": ["OpenAI"], "kwargs": {"model_name": "gpt-3.5-turbo-instruct"}},
+            ["prompt"],
+            invocation_params={"model_name": "gpt-3.5-turbo-instruct"},
+            **kwargs,
+        )
+    elif callback == "tool":
+        handler.on_tool_start({"name": "search"}, "query", **kwargs)
+    else:
+        handler.on_retriever_start({"id": ["Retriever"]}, "query", **kwargs)
+
+    assert run_id.int in handler.runs
+    body = task_manager.events[-1]["body"]
+    assert body["traceId"] == "trace-id"
+    assert body.get("parentObservationId") == ("span-id" if root_span else None)
@@ -0,0 +1,301 @@
+import json
+
+import httpx
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Request, Response
+
+from langfuse.api.client import AsyncFernLangfuse, FernLangfuse
+from langfuse.api.core.api_error import ApiError
+from langfuse.api.resources.commons.errors import UnauthorizedError
+
+TRACE = {
+    "id": "trace-1",
+    "timestamp": "2024-01-01T00:00:00.000Z",
+    "name": "test",
+    "observations": [],
+    "scores": [],
+}
+
+
+def create_client(httpserver: HTTPServer):
+    return FernLangfuse(
+        base_url=httpserver.url_for("/").rstrip("/"),
+        username="public_key",
+        password="secret_key",
+        httpx_client=httpx.Client(),
+    )
+
+
+def create_async_client(httpserver: HTTPServer):
+    return AsyncFernLangfuse(
+        base_url=httpserver.url_for("/").rstrip("/"),
+        username="public_key",
+        password="secret_key",
+        httpx_client=httpx.AsyncClient(),
+    )
+
+
+def etag_handler(requests: list):
+    def handler(request: Request):
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return Response(status=304)
+        return Response(
+            response=json.dumps(TRACE),
+            status=200,
+            headers={"ETag": '"v1"'},
+            content_type="application/json",
+        )
+
+    return handler
+
+
+@pytest.mark.timeout(10)
+def test_get_trace_revalidates_with_etag(httpserver: HTTPServer):
+    requests = []
+    httpserver.expect_request(
+        "/api/public/traces/trace-1", method="GET"
+    ).respond_with_handler(etag_handler(requests))
+
+    client = create_client(httpserver)
+
+    first = client.trace.get("trace-1")
+    second = client.trace.get("trace-1")
+
+    assert first.id == "trace-1"
+    assert second is first
+    assert len(requests) == 2
+    assert "If-None-Match" not in requests[0].headers
+    assert requests[1].headers["If-None-Match"] == '"v1"'
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_get_trace_revalidates_with_etag(httpserver: HTTPServer):
+    requests = []
+    httpserver.expect_request(
+        "/api/public/traces/trace-1", method="GET"
+    ).respond_with_handler(etag_handler(requests))
+
+    client = create_async_client(httpserver)
+
+    first = await client.trace.get("trace-1")
+    second = await client.trace.get("trace-1")
+
+    assert second is first
+    assert requests[1].headers["If-None-Match"] == '"v1"'
+
+
+def list_handler(requests: list, cache_control: str):
+    def handler(request: Request):
+        requests.append(request)
+        return Response(
+            response=json.dumps(
+                {
+                    "data": [TRACE],
+                    "meta": {"page": 1, "limit": 50, "totalItems": 1, "totalPages": 1},
+                }
+            ),
+            status=200,
+            headers={"Cache-Control": cache_control},
+            content_type="application/json",
+        )
+
+    return handler
+
+
+@pytest.mark.timeout(10)
+def test_list_traces_cached_for_max_age(httpserver: HTTPServer):
+    requests = []
+    httpserver.expect_request("/api/public/traces", method="GET").respond_with_handler(
+        list_handler(requests, "max-age=60")
+    )
+
+    client = create_client(httpserver)
+
+    first = client.trace.list(order_by="timestamp.desc", tags=["a", "b"])
+    second = client.trace.list(order_by="timestamp.desc", tags=["a", "b"])
+    other_page = client.trace.list(order_by="timestamp.desc", tags=["a", "b"], page=2)
+
+    assert second is first
+    assert other_page is not first
+    assert len(requests) == 2
+
+
+@pytest.mark.timeout(10)
+def test_list_traces_query_string(httpserver: HTTPServer):
+    requests = []
+    httpserver.expect_request("/api/public/traces", method="GET").respond_with_handler(
+        list_handler(requests, "no-store")
+    )
+
+    client = create_client(httpserver)
+
+    client.trace.list(order_by="timestamp.desc", tags=["a", "b"])
+    client.trace.list(order_by="timestamp.desc", page=2, limit=10, tags="a")
+
+    assert requests[0].query_string == b"orderBy=timestamp.desc&tags=a&tags=b"
+    assert "page" not in requests[0].args
+    assert "limit" not in requests[0].args
+    assert requests[1].args.to_dict(flat=False) == {
+        "page": ["2"],
+        "limit": ["10"],
+        "orderBy": ["timestamp.desc"],
+        "tags": ["a"],
+    }
+
+
+@pytest.mark.timeout(10)
+def test_list_traces_not_cached_with_no_store(httpserver: HTTPServer):
+    requests = []
+    httpserver.expect_request("/api/public/traces", method="GET").respond_with_handler(
+        list_handler(requests, "max-age=60, no-store")
+    )
+
+    client = create_client(httpserver)
+
+    client.trace.list(order_by="timestamp.desc")
+    client.trace.list(order_by="timestamp.desc")
+
+    assert len(requests) == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_get_many_traces(httpserver: HTTPServer):
+    for trace_id in ["trace-1", "trace-2", "trace-3"]:
+        httpserver.expect_request(
+            f"/api/public/traces/{trace_id}", method="GET"
+        ).respond_with_json({**TRACE, "id": trace_id})
+
+    client = create_async_client(httpserver)
+
+    traces = await client.trace.get_many(
+        ["trace-1", "trace-2", "trace-3"], concurrency=2
+    )
+
+    assert [trace.id for trace in traces] == ["trace-1", "trace-2", "trace-3"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.timeout(10)
+async def test_async_get_many_traces_without_validation(httpserver: HTTPServer):
+    httpserver.expect_request(
+        "/api/public/traces/trace-1", method="GET"
+    ).respond_with_json(TRACE)
+
+    client = create_async_client(httpserver)
+
+    traces = await client.trace.get_many(["trace-1"], validate=False)
+
+    assert traces[0].id == "trace-1"
+    assert traces[0].timestamp == TRACE["timestamp"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("concurrency", [0, -1])
+async def test_async_get_many_rejects_invalid_concurrency(
+    httpserver: HTTPServer, concurrency: int
+):
+    client = create_async_client(httpserver)
+
+    with pytest.raises(ValueError):
+        await client.trace.get_many(["trace-1"], concurrency=concurrency)
+
+
+@pytest.mark.timeout(10)
+def test_list_large_page_of_traces(httpserver: HTTPServer):
+    traces = [{**TRACE, "id": f"trace-{i}"} for i in range(1000)]
+    httpserver.expect_request("/api/public/traces", method="GET").respond_with_json(
+        {
+            "data": traces,
+            "meta": {"page": 1, "limit": 1000, "totalItems": 1000, "totalPages": 1},
+        }
+    )
+
+    client = create_client(httpserver)
+
+    result = client.trace.list(order_by="timestamp.desc", limit=1000)
+
+    assert [trace.id for trace in result.data] == [trace["id"] for trace in traces]
+    assert result.meta.total_items == 1000
+
+
+@pytest.mark.timeout(10)
+def test_get_trace_without_validation(httpserver: HTTPServer):
+    httpserver.expect_request(
+        "/api/public/traces/trace-1", method="GET"
+    ).respond_with_json({**TRACE, "userId": "user-1"})
+
+    client = create_client(httpserver)
+
+    trace = client.trace.get("trace-1", validate=False)
+
+    assert trace.id == "trace-1"
+    assert trace.user_id == "user-1"
+    assert trace.timestamp == TRACE["timestamp"]
+
+
+@pytest.mark.timeout(10)
+def test_get_trace_json_401_raises_unauthorized(httpserver: HTTPServer):
+    httpserver.expect_request(
+        "/api/public/traces/trace-1", method="GET"
+    ).respond_with_json({"message": "Invalid credentials"}, status=401)
+
+    client = create_client(httpserver)
+
+    with pytest.raises(UnauthorizedError) as e:
+        client.trace.get("trace-1")
+
+    assert e.value.status_code == 401
+    assert e.value.body == {"message": "Invalid credentials"}
+
+
+@pytest.mark.timeout(10)
+def test_get_trace_html_404_raises_api_error_with_text(httpserver: HTTPServer):
+    httpserver.expect_request(
+        "/api/public/traces/trace-1", method="GET"
+    ).respond_with_data("<html>Not Found</html>", status=404, content_type="text/html")
+
+    client = create_client(httpserver)
+
+    with pytest.raises(ApiError) as e:
+        client.trace.get("trace-1")
+
+    assert type(e.value) is ApiError
+    assert e.value.status_code == 404
+    assert e.value.body == "<html>Not Found</html>"
+
+
+@pytest.mark.timeout(10)
+def test_get_trace_invalid_utf8_error_body_is_replaced(httpserver: HTTPServer):
+    httpserver.expect_request(
+        "/api/public/traces/trace-1", method="GET"
+    ).respond_with_data(b"bad \xff body", status=502)
+
+    client = create_client(httpserver)
+
+    with pytest.raises(ApiError) as e:
+        client.trace.get("trace-1")
+
+    assert e.value.status_code == 502
+    assert e.value.body == "bad \ufffd body"
+
+
+@pytest.mark.timeout(10)
+def test_get_trace_unknown_status_raises_api_error_with_json(
+    httpserver: HTTPServer,
+):
+    httpserver.expect_request(
+        "/api/public/traces/trace-1", method="GET"
+    ).respond_with_json({"message": "Slow down"}, status=429)
+
+    client = create_client(httpserver)
+
+    with pytest.raises(ApiError) as e:
+        client.trace.get("trace-1")
+
+    assert type(e.value) is ApiError
+    assert e.value.status_code == 429
+    assert e.value.body == {"message": "Slow down"}